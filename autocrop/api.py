@@ -2,78 +2,163 @@
 """
 Simple HTTP API wrapper for the autocrop script.
 Allows n8n to call the autocrop functionality via HTTP requests.
-Supports MinIO for input/output file handling.
+Conversions are queued as RQ jobs (see jobs.py) and run by worker.py.
 """
 
-from flask import Flask, request, jsonify
-import subprocess
+from quart import Quart, request, jsonify
+import asyncio
+import hashlib
 import os
-import uuid
 import logging
-import boto3
-from botocore.client import Config
-import tempfile
-from urllib.parse import urlparse
+from redis import Redis
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from botocore.exceptions import ClientError
+from jobs import convert, parse_minio_url, s3_client, MINIO_ENDPOINT, REDIS_URL, QUEUE_NAME, NOT_FOUND_CODES
 
-app = Flask(__name__)
+app = Quart(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# MinIO configuration
-MINIO_ENDPOINT = os.getenv('S3_ENDPOINT_URL', 'http://minio:9000')
-MINIO_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'minioadmin')
-MINIO_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'minioadmin')
-MINIO_BUCKET = os.getenv('S3_BUCKET_NAME', 'nca-toolkit')
-
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    endpoint_url=MINIO_ENDPOINT,
-    aws_access_key_id=MINIO_ACCESS_KEY,
-    aws_secret_access_key=MINIO_SECRET_KEY,
-    config=Config(signature_version='s3v4'),
-    region_name='us-east-1'
-)
-
-def parse_minio_url(url):
+# Job queue
+redis_conn = Redis.from_url(REDIS_URL)
+queue = Queue(QUEUE_NAME, connection=redis_conn)
+
+# Upper bound for a job: the 10 minute conversion plus transfers. RQ
+# interrupts the job when it expires.
+JOB_TIMEOUT = 700
+
+# How long a "wait": true request waits for its job (including time spent
+# queued). Kept below the n8n workflow's 15 minute HTTP timeout so the
+# caller always gets an answer.
+WAIT_TIMEOUT = 840
+
+# Finished jobs (and their results) stay available to /status for a day
+RESULT_TTL = 24 * 60 * 60
+
+# Seconds between job status checks when a caller waits for the result
+POLL_INTERVAL = 1
+
+# Job states in which an identical request joins the existing job
+ACTIVE_STATUSES = (JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED)
+
+# Seconds a request may hold (or wait for) the per-job enqueue lock
+ENQUEUE_LOCK_TIMEOUT = 10
+
+def enqueue_conversion(bucket, input_key, output_key, size, etag):
     """
-    Parse MinIO URL and extract bucket and key.
-    Example: http://minio:9000/nca-toolkit/file.mp4 -> ('nca-toolkit', 'file.mp4')
+    Queue a conversion job, or return the existing job if an identical
+    conversion is already queued or running. size and etag are the input's
+    ContentLength and ETag, so the job needn't look them up again.
     """
-    parsed = urlparse(url)
-    path_parts = parsed.path.lstrip('/').split('/', 1)
-    if len(path_parts) == 2:
-        return path_parts[0], path_parts[1]
-    return MINIO_BUCKET, path_parts[0]
+    # Deterministic ID, so identical requests map to the same job
+    job_id = hashlib.sha1(f"{bucket}/{input_key}\n{output_key}".encode('utf-8')).hexdigest()
+
+    # Fetch and enqueue under a Redis lock (SET NX), so two identical
+    # requests in different workers or threads can't both enqueue the job
+    with redis_conn.lock(
+        f"{QUEUE_NAME}:enqueue:{job_id}",
+        timeout=ENQUEUE_LOCK_TIMEOUT,
+        blocking_timeout=ENQUEUE_LOCK_TIMEOUT
+    ):
+        try:
+            job = Job.fetch(job_id, connection=redis_conn)
+            if job.get_status() in ACTIVE_STATUSES:
+                logger.info(f"Joining queued conversion {job_id}: {input_key} -> {output_key}")
+                return job
+            # Finished or failed: delete the old run, so its expiry (and its
+            # registry entries) don't carry over to the new job
+            job.delete()
+        except NoSuchJobError:
+            pass
+
+        logger.info(f"Queueing conversion {job_id}: {input_key} -> {output_key}")
+        return queue.enqueue(
+            convert, bucket, input_key, output_key, size, etag,
+            job_id=job_id,
+            job_timeout=JOB_TIMEOUT,
+            result_ttl=RESULT_TTL
+        )
+
+def job_error(job):
+    """
+    Return the error message of a failed job, if any.
+    """
+    result = job.latest_result()
+    return result.exc_string if result else None
+
+def job_result(job):
+    """
+    Return the (response body, HTTP status) result of a finished job.
+    """
+    result = job.return_value()
+    if result is None:
+        return {
+            "success": False,
+            "error": "Video conversion job returned no result"
+        }, 500
+    return result
+
+async def wait_for_job(job):
+    """
+    Wait for a job to finish without holding a worker thread.
+
+    Returns:
+        (response body, HTTP status) tuple
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WAIT_TIMEOUT
+
+    while loop.time() < deadline:
+        status = await asyncio.to_thread(job.get_status)
+        if status == JobStatus.FINISHED:
+            return await asyncio.to_thread(job_result, job)
+        if status not in ACTIVE_STATUSES:
+            return {
+                "success": False,
+                "error": f"Video conversion job {status}",
+                "details": await asyncio.to_thread(job_error, job)
+            }, 500
+        await asyncio.sleep(POLL_INTERVAL)
+
+    # The job keeps running; the caller can poll its status instead
+    return {
+        "success": False,
+        "error": "Timed out waiting for the video conversion job",
+        "job_id": job.id,
+        "status_url": f"/status/{job.id}"
+    }, 408
 
 @app.route('/health', methods=['GET'])
-def health():
+async def health():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "service": "autocrop", "minio": MINIO_ENDPOINT}), 200
 
 @app.route('/convert', methods=['POST'])
-def convert_video():
+async def convert_video():
     """
-    Convert horizontal video to vertical format.
+    Queue a conversion of a horizontal video to vertical format.
+
+    Concurrent requests for the same input and output share one job.
 
     Expected JSON body:
     {
         "input_url": "http://minio:9000/nca-toolkit/video_split_1.mp4",
-        "output_key": "video_vertical.mp4"  (optional, defaults to input_key with _vertical suffix)
+        "output_key": "video_vertical.mp4",  (optional, defaults to input_key with _vertical suffix)
+        "wait": false  (optional, true waits for the job and returns its result)
     }
 
-    Returns:
+    Returns (202):
     {
         "success": true,
-        "output_url": "http://minio:9000/nca-toolkit/video_vertical.mp4",
-        "message": "Video converted successfully"
+        "job_id": "3f7a...",
+        "status": "queued",
+        "status_url": "/status/3f7a..."
     }
     """
-    temp_input = None
-    temp_output = None
-
     try:
-        data = request.get_json()
+        data = await request.get_json()
 
         if not data or 'input_url' not in data:
             return jsonify({
@@ -85,116 +170,90 @@ def convert_video():
 
         # Parse MinIO URL
         bucket, input_key = parse_minio_url(input_url)
-        logger.info(f"Downloading from MinIO: bucket={bucket}, key={input_key}")
 
-        # Create temporary files
-        temp_input = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        temp_output = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        temp_input.close()
-        temp_output.close()
-
-        # Download input file from MinIO
+        # Fail fast on a missing input instead of queueing a doomed job
         try:
-            s3_client.download_file(bucket, input_key, temp_input.name)
-            logger.info(f"Downloaded input file to {temp_input.name}")
-        except Exception as e:
-            logger.error(f"Failed to download from MinIO: {e}")
+            head = await asyncio.to_thread(s3_client.head_object, Bucket=bucket, Key=input_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in NOT_FOUND_CODES:
+                logger.error(f"Failed to check input in MinIO: {e}")
+                return jsonify({
+                    "success": False,
+                    "error": f"Failed to check input file in MinIO: {str(e)}"
+                }), 500
+            logger.error(f"Input not found in MinIO: {e}")
             return jsonify({
                 "success": False,
                 "error": f"Failed to download input file from MinIO: {str(e)}"
             }), 404
 
-        # Determine output key
-        if 'output_key' in data and data['output_key']:
-            output_key = data['output_key']
-        else:
-            # Generate output key with _vertical suffix
-            base_name = os.path.splitext(input_key)[0]
-            output_key = f"{base_name}_vertical.mp4"
-
-        logger.info(f"Converting video: {input_key} -> {output_key}")
-
-        # Run the autocrop script
-        cmd = [
-            'python', '/app/main.py',
-            '--input', temp_input.name,
-            '--output', temp_output.name
-        ]
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=600  # 10 minute timeout
-        )
+        # Determine output key (defaults to the input key with a _vertical suffix)
+        output_key = data.get('output_key') or f"{os.path.splitext(input_key)[0]}_vertical.mp4"
 
-        if result.returncode != 0:
-            logger.error(f"Autocrop failed: {result.stderr}")
-            return jsonify({
-                "success": False,
-                "error": "Video conversion failed",
-                "details": result.stderr
-            }), 500
-
-        # Check if output file was created
-        if not os.path.exists(temp_output.name):
-            logger.error(f"Output file was not created: {temp_output.name}")
-            logger.error(f"Autocrop stdout: {result.stdout}")
-            logger.error(f"Autocrop stderr: {result.stderr}")
-            return jsonify({
-                "success": False,
-                "error": f"Output file was not created: {temp_output.name}",
-                "stdout": result.stdout,
-                "stderr": result.stderr
-            }), 500
+        job = await asyncio.to_thread(
+            enqueue_conversion, bucket, input_key, output_key,
+            head['ContentLength'], head['ETag'].strip('"')
+        )
 
-        # Upload output file to MinIO
-        try:
-            s3_client.upload_file(temp_output.name, bucket, output_key)
-            output_url = f"{MINIO_ENDPOINT}/{bucket}/{output_key}"
-            logger.info(f"Uploaded output file to MinIO: {output_url}")
-        except Exception as e:
-            logger.error(f"Failed to upload to MinIO: {e}")
-            logger.error(f"Output file exists: {os.path.exists(temp_output.name)}")
-            logger.error(f"Output file path: {temp_output.name}")
-            return jsonify({
-                "success": False,
-                "error": f"Failed to upload output file to MinIO: {str(e)}"
-            }), 500
+        if data.get('wait'):
+            body, status = await wait_for_job(job)
+            return jsonify(body), status
 
         return jsonify({
             "success": True,
-            "output_url": output_url,
-            "output_key": output_key,
-            "message": "Video converted successfully",
-            "log": result.stdout
-        }), 200
+            "job_id": job.id,
+            "status": job.get_status(refresh=False),
+            "status_url": f"/status/{job.id}"
+        }), 202
+
+    except Exception as e:
+        logger.exception("Unexpected error queueing video conversion")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/status/<job_id>', methods=['GET'])
+async def job_status(job_id):
+    """
+    Report the state of a conversion job.
 
-    except subprocess.TimeoutExpired:
+    Returns:
+    {
+        "job_id": "3f7a...",
+        "status": "finished",
+        "result": {...},  (the /convert result, once finished)
+        "error": "..."  (once failed)
+    }
+    """
+    try:
+        job = await asyncio.to_thread(Job.fetch, job_id, connection=redis_conn)
+    except NoSuchJobError:
         return jsonify({
             "success": False,
-            "error": "Video conversion timed out (max 10 minutes)"
-        }), 408
+            "error": f"Unknown job: {job_id}"
+        }), 404
+
+    try:
+        status = await asyncio.to_thread(job.get_status)
+        body = {"job_id": job.id, "status": status}
+
+        if status == JobStatus.FINISHED:
+            result, result_status = await asyncio.to_thread(job_result, job)
+            body["result"] = result
+            body["result_status"] = result_status
+        elif status not in ACTIVE_STATUSES:
+            body["error"] = await asyncio.to_thread(job_error, job)
+
+        return jsonify(body), 200
 
     except Exception as e:
-        logger.exception("Unexpected error during video conversion")
+        logger.exception(f"Unexpected error reading job {job_id}")
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
-    finally:
-        # Clean up temporary files
-        if temp_input and os.path.exists(temp_input.name):
-            try:
-                os.unlink(temp_input.name)
-            except:
-                pass
-        if temp_output and os.path.exists(temp_output.name):
-            try:
-                os.unlink(temp_output.name)
-            except:
-                pass
-
 if __name__ == '__main__':
+    # Local debugging only; production runs under Hypercorn (see hypercorn_conf.py)
     app.run(host='0.0.0.0', port=8083, debug=False)
\ No newline at end of file
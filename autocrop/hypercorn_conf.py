@@ -0,0 +1,16 @@
+"""
+Hypercorn settings for the autocrop API.
+Usage: hypercorn --config file:hypercorn_conf.py api:app
+"""
+
+import multiprocessing
+import os
+
+bind = ['0.0.0.0:8083']
+worker_class = 'asyncio'
+
+# API workers only queue and poll conversion jobs (see worker.py)
+workers = int(os.getenv('AUTOCROP_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# Let requests waiting on a job (see WAIT_TIMEOUT in api.py) finish on shutdown
+graceful_timeout = 840
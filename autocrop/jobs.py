@@ -0,0 +1,378 @@
+"""
+Autocrop conversion jobs.
+Downloads a video from MinIO, converts it to vertical format and uploads the
+result. Jobs are queued by the HTTP API and run by the RQ worker (worker.py).
+"""
+
+from collections import deque
+import os
+import shutil
+import subprocess
+import logging
+import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.client import Config
+from botocore.exceptions import ClientError
+from rq.timeouts import JobTimeoutException
+from s3transfer.subscribers import BaseSubscriber
+import tempfile
+from urllib.parse import urlparse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# MinIO configuration
+MINIO_ENDPOINT = os.getenv('S3_ENDPOINT_URL', 'http://minio:9000')
+MINIO_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'minioadmin')
+MINIO_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'minioadmin')
+MINIO_BUCKET = os.getenv('S3_BUCKET_NAME', 'nca-toolkit')
+
+# Job queue configuration
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+QUEUE_NAME = 'autocrop'
+
+# Initialize S3 client. boto3 clients are thread-safe, so this single client
+# (and its keep-alive connection pool) is shared by every transfer thread.
+s3_client = boto3.client(
+    's3',
+    endpoint_url=MINIO_ENDPOINT,
+    aws_access_key_id=MINIO_ACCESS_KEY,
+    aws_secret_access_key=MINIO_SECRET_KEY,
+    config=Config(
+        signature_version='s3v4',
+        max_pool_connections=64,
+        retries={'max_attempts': 3, 'mode': 'standard'},
+        tcp_keepalive=True,
+        # Static endpoint: path-style URLs, no per-bucket host resolution
+        s3={'addressing_style': 'path'},
+        # Skip the default CRC checksum over every uploaded part
+        request_checksum_calculation='when_required',
+        response_checksum_validation='when_required'
+    ),
+    region_name='us-east-1'
+)
+
+# Transfer settings for video downloads/uploads: 8 MB parts, 8 parts in flight.
+# Objects below the threshold go through a single GetObject/PutObject.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+    io_chunksize=1024 * 1024
+)
+
+# Converted outputs are also kept in MinIO as <CACHE_PREFIX><input ETag>.mp4
+# (expired by a bucket lifecycle rule), so retries skip the conversion
+CACHE_PREFIX = os.getenv('AUTOCROP_CACHE_PREFIX', 'autocrop-cache/')
+
+# Conversions run in-process by default; worker.py preloads the autocrop
+# model so every forked job inherits it. AUTOCROP_SUBPROCESS=1 falls back to
+# running main.py in a child process per job.
+USE_SUBPROCESS = os.getenv('AUTOCROP_SUBPROCESS', '0') == '1'
+
+# Intermediate MP4s go to tmpfs (RAM) instead of disk when there is room
+TMPDIR = os.getenv('AUTOCROP_TMPDIR', '/dev/shm')
+
+# Number of conversions run in parallel (see worker.py)
+NUM_WORKERS = int(os.getenv('AUTOCROP_JOB_WORKERS', 2))
+
+# Only the tail of the converter's output is kept for the response log
+LOG_LIMIT = 64 * 1024
+
+# S3 error codes for a missing object
+NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+# S3 error codes for a failed If-Match (the object changed)
+PRECONDITION_FAILED_CODES = ('412', 'PreconditionFailed')
+
+def parse_minio_url(url):
+    """
+    Parse MinIO URL and extract bucket and key.
+    Example: http://minio:9000/nca-toolkit/file.mp4 -> ('nca-toolkit', 'file.mp4')
+    """
+    parsed = urlparse(url)
+    path_parts = parsed.path.lstrip('/').split('/', 1)
+    if len(path_parts) == 2:
+        return path_parts[0], path_parts[1]
+    return MINIO_BUCKET, path_parts[0]
+
+def copy_cached_output(bucket, cached_key, output_key):
+    """
+    Copy a cached conversion to output_key if it exists.
+
+    Returns:
+        True if the cached output was copied
+    """
+    try:
+        s3_client.head_object(Bucket=bucket, Key=cached_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in NOT_FOUND_CODES:
+            logger.warning(f"Failed to check conversion cache {cached_key}: {e}")
+        return False
+
+    try:
+        s3_client.copy_object(
+            CopySource={'Bucket': bucket, 'Key': cached_key},
+            Bucket=bucket,
+            Key=output_key
+        )
+        return True
+    except JobTimeoutException:
+        raise  # Reported by convert() as a timeout
+    except Exception as e:
+        logger.warning(f"Failed to copy cached conversion {cached_key}: {e}")
+        return False
+
+def run_autocrop(input_path, output_path):
+    """
+    Run the autocrop conversion in-process.
+
+    Returns:
+        (returncode, stdout, stderr) tuple, mirroring the subprocess runner
+    """
+    lines = deque(maxlen=1000)
+
+    def log(*args):
+        lines.append(' '.join(str(arg) for arg in args))
+
+    # Imported here so the API process never loads the model
+    from main import convert as autocrop_convert
+
+    try:
+        autocrop_convert(input_path, output_path, log)
+    except JobTimeoutException:
+        raise  # Reported by convert() as a timeout
+    except Exception as e:
+        return 1, '\n'.join(lines)[-LOG_LIMIT:], str(e)[-LOG_LIMIT:]
+
+    return 0, '\n'.join(lines)[-LOG_LIMIT:], ''
+
+def read_tail(f, limit=LOG_LIMIT):
+    """
+    Read the last `limit` bytes of a file.
+    """
+    f.seek(max(0, f.seek(0, os.SEEK_END) - limit))
+    return f.read().decode('utf-8', 'replace')
+
+def run_autocrop_subprocess(input_path, output_path):
+    """
+    Run the autocrop script in a child process.
+
+    Returns:
+        (returncode, stdout, stderr) tuple
+    """
+    cmd = [
+        'python', '/app/main.py',
+        '--input', input_path,
+        '--output', output_path
+    ]
+
+    # Output goes to temporary files rather than pipes, so chatty output
+    # can't grow memory without limit; only the tails are read back.
+    # subprocess.run kills the child if the job is interrupted.
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        result = subprocess.run(cmd, stdout=stdout, stderr=stderr)
+        return result.returncode, read_tail(stdout), read_tail(stderr)
+
+def input_changed(e):
+    """
+    Check whether a download failed because the object no longer matches the
+    expected ETag. The transfer manager raises its own error for this, with
+    the S3 error as its context.
+    """
+    for error in (e, e.__context__):
+        if isinstance(error, ClientError) and error.response['Error']['Code'] in PRECONDITION_FAILED_CODES:
+            return True
+    return False
+
+class KnownObjectSubscriber(BaseSubscriber):
+    """
+    Hands an already known size and ETag to the transfer manager, so it
+    skips its own HeadObject and sends the ETag as IfMatch on every part.
+    """
+
+    def __init__(self, size, etag):
+        self.size = size
+        self.etag = etag
+
+    def on_queued(self, future, **kwargs):
+        future.meta.provide_transfer_size(self.size)
+        future.meta.provide_object_etag(self.etag)
+
+def download_input(bucket, input_key, path, size, etag):
+    """
+    Download the input video. Small files use a single GetObject; larger ones
+    go through the multipart transfer manager. Fails with a 412 if the object
+    no longer matches etag.
+    """
+    if size < TRANSFER_CONFIG.multipart_threshold:
+        body = s3_client.get_object(Bucket=bucket, Key=input_key, IfMatch=f'"{etag}"')['Body']
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(body, f, TRANSFER_CONFIG.io_chunksize)
+    else:
+        with create_transfer_manager(s3_client, TRANSFER_CONFIG) as manager:
+            manager.download(
+                bucket, input_key, path,
+                subscribers=[KnownObjectSubscriber(size, f'"{etag}"')]
+            ).result()
+
+def pick_temp_dir(input_size):
+    """
+    Return TMPDIR if it has room for the input and output videos,
+    otherwise the system default temp directory.
+
+    Jobs starting together all see the same free space, so room is checked
+    for every worker, as if each were converting a video of this size.
+    """
+    try:
+        if shutil.disk_usage(TMPDIR).free >= 2 * input_size * NUM_WORKERS:
+            return TMPDIR
+    except OSError:
+        pass
+    logger.info(f"Not enough space in {TMPDIR}, using {tempfile.gettempdir()}")
+    return tempfile.gettempdir()
+
+def convert(bucket, input_key, output_key, size=None, etag=None):
+    """
+    Download the input from MinIO, run the autocrop script and upload the result.
+    Runs as an RQ job; the job timeout bounds the whole conversion.
+
+    Args:
+        size, etag: The input's ContentLength and ETag, as already read by
+            the API; looked up with head_object when not given
+
+    Returns:
+        (response body, HTTP status) tuple
+    """
+    try:
+        # The input's ETag finds earlier conversions of the same content
+        if size is None or etag is None:
+            try:
+                head = s3_client.head_object(Bucket=bucket, Key=input_key)
+            except JobTimeoutException:
+                raise  # Reported by convert() as a timeout
+            except Exception as e:
+                logger.error(f"Failed to find input in MinIO: {e}")
+                return {
+                    "success": False,
+                    "error": f"Failed to download input file from MinIO: {str(e)}"
+                }, 404
+            size = head['ContentLength']
+            etag = head['ETag'].strip('"')
+
+        # Same content converted before: copy the cached output server-side
+        cached_key = f"{CACHE_PREFIX}{etag}.mp4"
+        if copy_cached_output(bucket, cached_key, output_key):
+            output_url = f"{MINIO_ENDPOINT}/{bucket}/{output_key}"
+            logger.info(f"Copied cached conversion {cached_key} -> {output_url}")
+            return {
+                "success": True,
+                "output_url": output_url,
+                "output_key": output_key,
+                "message": "Video converted successfully (cached)",
+                "log": ""
+            }, 200
+
+        logger.info(f"Downloading from MinIO: bucket={bucket}, key={input_key}")
+
+        # Work in a temporary directory that is removed together with its contents
+        temp_dir = pick_temp_dir(size)
+        with tempfile.TemporaryDirectory(prefix='autocrop_', dir=temp_dir, ignore_cleanup_errors=True) as work_dir:
+            input_path = os.path.join(work_dir, 'in.mp4')
+            output_path = os.path.join(work_dir, 'out.mp4')
+
+            # Download input file from MinIO
+            try:
+                download_input(bucket, input_key, input_path, size, etag)
+                logger.info(f"Downloaded input file to {input_path}")
+            except JobTimeoutException:
+                raise  # Reported by convert() as a timeout
+            except Exception as e:
+                if input_changed(e):
+                    # Replaced after the request was checked; the cache lookup
+                    # above used the old ETag, so the caller has to resubmit
+                    logger.error(f"Input changed since the request was queued: {input_key}")
+                    return {
+                        "success": False,
+                        "error": f"Input file changed since the request was queued: {input_key}"
+                    }, 409
+                logger.error(f"Failed to download from MinIO: {e}")
+                return {
+                    "success": False,
+                    "error": f"Failed to download input file from MinIO: {str(e)}"
+                }, 404
+
+            logger.info(f"Converting video: {input_key} -> {output_key}")
+
+            # Run autocrop
+            if USE_SUBPROCESS:
+                returncode, stdout, stderr = run_autocrop_subprocess(input_path, output_path)
+            else:
+                returncode, stdout, stderr = run_autocrop(input_path, output_path)
+
+            if returncode != 0:
+                logger.error(f"Autocrop failed: {stderr}")
+                return {
+                    "success": False,
+                    "error": "Video conversion failed",
+                    "details": stderr
+                }, 500
+
+            # Check if output file was created
+            if not os.path.exists(output_path):
+                logger.error(f"Output file was not created: {output_path}")
+                logger.error(f"Autocrop stdout: {stdout}")
+                logger.error(f"Autocrop stderr: {stderr}")
+                return {
+                    "success": False,
+                    "error": f"Output file was not created: {output_path}",
+                    "stdout": stdout,
+                    "stderr": stderr
+                }, 500
+
+            # Upload output file to MinIO. It goes to the conversion cache
+            # first and is copied to output_key server-side: output_key is
+            # caller-chosen and another job may overwrite it, so the cache
+            # entry is never copied from there.
+            try:
+                s3_client.upload_file(output_path, bucket, cached_key, Config=TRANSFER_CONFIG)
+                s3_client.copy_object(
+                    CopySource={'Bucket': bucket, 'Key': cached_key},
+                    Bucket=bucket,
+                    Key=output_key
+                )
+                output_url = f"{MINIO_ENDPOINT}/{bucket}/{output_key}"
+                logger.info(f"Uploaded output file to MinIO: {output_url}")
+            except JobTimeoutException:
+                raise  # Reported by convert() as a timeout
+            except Exception as e:
+                logger.error(f"Failed to upload to MinIO: {e}")
+                logger.error(f"Output file exists: {os.path.exists(output_path)}")
+                logger.error(f"Output file path: {output_path}")
+                return {
+                    "success": False,
+                    "error": f"Failed to upload output file to MinIO: {str(e)}"
+                }, 500
+
+        return {
+            "success": True,
+            "output_url": output_url,
+            "output_key": output_key,
+            "message": "Video converted successfully",
+            "log": stdout
+        }, 200
+
+    except JobTimeoutException:
+        # Raised inside the job by RQ when the job timeout expires
+        return {
+            "success": False,
+            "error": "Video conversion timed out"
+        }, 408
+
+    except Exception as e:
+        logger.exception("Unexpected error during video conversion")
+        return {
+            "success": False,
+            "error": str(e)
+        }, 500
@@ -3,6 +3,7 @@ import cv2
 import scenedetect
 import subprocess
 import argparse
+import sys
 from scenedetect import VideoManager, SceneManager
 from scenedetect.detectors import ContentDetector
 from ultralytics import YOLO
@@ -129,42 +130,38 @@ def get_video_resolution(video_path):
     cap.release()
     return width, height
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="Smartly crops a horizontal video into a vertical one.")
-    parser.add_argument('-i', '--input', type=str, required=True, help="Path to the input video file.")
-    parser.add_argument('-o', '--output', type=str, required=True, help="Path to the output video file.")
-    args = parser.parse_args()
+def convert(input_video, final_output_video, log=print):
+    """
+    Crop a horizontal video into a vertical one.
 
-    script_start_time = time.time()
+    Args:
+        input_video: Path to the input video file
+        final_output_video: Path to the output video file
+        log: Callable used for progress messages (print-compatible)
 
-    input_video = args.input
-    final_output_video = args.output
-    
-    # Define temporary file paths based on the output name
-    base_name = os.path.splitext(final_output_video)[0]
-    temp_video_output = f"{base_name}_temp_video.mp4"
-    temp_audio_output = f"{base_name}_temp_audio.aac"
+    Raises:
+        RuntimeError: If the video could not be converted
+    """
+    script_start_time = time.time()
     
-    # Clean up previous temp files if they exist
-    if os.path.exists(temp_video_output): os.remove(temp_video_output)
-    if os.path.exists(temp_audio_output): os.remove(temp_audio_output)
+    # Clean up a previous output if it exists
     if os.path.exists(final_output_video): os.remove(final_output_video)
 
-    print("🎬 Step 1: Detecting scenes...")
+    log("🎬 Step 1: Detecting scenes...")
     step_start_time = time.time()
     scenes, fps = detect_scenes(input_video)
     step_end_time = time.time()
     
     if not scenes:
-        print("❌ No scenes were detected. Aborting.")
-        exit()
+        log("❌ No scenes were detected. Aborting.")
+        raise RuntimeError("No scenes were detected")
     
-    print(f"✅ Found {len(scenes)} scenes in {step_end_time - step_start_time:.2f}s. Here is the breakdown:")
+    log(f"✅ Found {len(scenes)} scenes in {step_end_time - step_start_time:.2f}s. Here is the breakdown:")
     for i, (start, end) in enumerate(scenes):
-        print(f"  - Scene {i+1}: {start.get_timecode()} -> {end.get_timecode()}")
+        log(f"  - Scene {i+1}: {start.get_timecode()} -> {end.get_timecode()}")
 
 
-    print("\n🧠 Step 2: Analyzing scene content and determining strategy...")
+    log("\n🧠 Step 2: Analyzing scene content and determining strategy...")
     step_start_time = time.time()
     original_width, original_height = get_video_resolution(input_video)
     
@@ -185,24 +182,30 @@ if __name__ == '__main__':
             'target_box': target_box
         })
     step_end_time = time.time()
-    print(f"✅ Scene analysis complete in {step_end_time - step_start_time:.2f}s.")
+    log(f"✅ Scene analysis complete in {step_end_time - step_start_time:.2f}s.")
 
-    print("\n📋 Step 3: Generated Processing Plan")
+    log("\n📋 Step 3: Generated Processing Plan")
     for i, scene_data in enumerate(scenes_analysis):
         num_people = len(scene_data['analysis'])
         strategy = scene_data['strategy']
         start_time = scenes[i][0].get_timecode()
         end_time = scenes[i][1].get_timecode()
-        print(f"  - Scene {i+1} ({start_time} -> {end_time}): Found {num_people} person(s). Strategy: {strategy}")
+        log(f"  - Scene {i+1} ({start_time} -> {end_time}): Found {num_people} person(s). Strategy: {strategy}")
 
-    print("\n✂️ Step 4: Processing video frames...")
+    log("\n✂️ Step 4: Processing video frames and muxing original audio...")
     step_start_time = time.time()
     
+    # Encode the cropped frames from stdin and copy the audio track straight from
+    # the input, so the final file is written in a single pass with no
+    # intermediate video/audio files on disk. Only errors are logged: stderr
+    # isn't read until encoding ends, so progress output could fill the pipe.
     command = [
-        'ffmpeg', '-y', '-f', 'rawvideo', '-vcodec', 'rawvideo',
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'rawvideo', '-vcodec', 'rawvideo',
         '-s', f'{OUTPUT_WIDTH}x{OUTPUT_HEIGHT}', '-pix_fmt', 'bgr24',
-        '-r', str(fps), '-i', '-', '-c:v', 'libx264',
-        '-preset', 'fast', '-crf', '23', '-an', temp_video_output
+        '-r', str(fps), '-i', '-', '-i', input_video,
+        '-map', '0:v:0', '-map', '1:a?', '-c:v', 'libx264',
+        '-preset', 'fast', '-crf', '23', '-c:a', 'copy', final_output_video
     ]
 
     ffmpeg_process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
@@ -213,82 +216,67 @@ if __name__ == '__main__':
     frame_number = 0
     current_scene_index = 0
     
-    with tqdm(total=total_frames, desc="Applying Plan") as pbar:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if current_scene_index < len(scenes_analysis) - 1 and \
-               frame_number >= scenes_analysis[current_scene_index + 1]['start_frame']:
-                current_scene_index += 1
-
-            scene_data = scenes_analysis[current_scene_index]
-            strategy = scene_data['strategy']
-            target_box = scene_data['target_box']
-
-            if strategy == 'TRACK':
-                crop_box = calculate_crop_box(target_box, original_width, original_height)
-                processed_frame = frame[crop_box[1]:crop_box[3], crop_box[0]:crop_box[2]]
-                output_frame = cv2.resize(processed_frame, (OUTPUT_WIDTH, OUTPUT_HEIGHT))
-            else: # LETTERBOX
-                scale_factor = OUTPUT_WIDTH / original_width
-                scaled_height = int(original_height * scale_factor)
-                scaled_frame = cv2.resize(frame, (OUTPUT_WIDTH, scaled_height))
+    try:
+        with tqdm(total=total_frames, desc="Applying Plan") as pbar:
+            while cap.isOpened():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+
+                if current_scene_index < len(scenes_analysis) - 1 and \
+                   frame_number >= scenes_analysis[current_scene_index + 1]['start_frame']:
+                    current_scene_index += 1
+
+                scene_data = scenes_analysis[current_scene_index]
+                strategy = scene_data['strategy']
+                target_box = scene_data['target_box']
+
+                if strategy == 'TRACK':
+                    crop_box = calculate_crop_box(target_box, original_width, original_height)
+                    processed_frame = frame[crop_box[1]:crop_box[3], crop_box[0]:crop_box[2]]
+                    output_frame = cv2.resize(processed_frame, (OUTPUT_WIDTH, OUTPUT_HEIGHT))
+                else: # LETTERBOX
+                    scale_factor = OUTPUT_WIDTH / original_width
+                    scaled_height = int(original_height * scale_factor)
+                    scaled_frame = cv2.resize(frame, (OUTPUT_WIDTH, scaled_height))
                 
-                output_frame = np.zeros((OUTPUT_HEIGHT, OUTPUT_WIDTH, 3), dtype=np.uint8)
-                y_offset = (OUTPUT_HEIGHT - scaled_height) // 2
-                output_frame[y_offset:y_offset + scaled_height, :] = scaled_frame
+                    output_frame = np.zeros((OUTPUT_HEIGHT, OUTPUT_WIDTH, 3), dtype=np.uint8)
+                    y_offset = (OUTPUT_HEIGHT - scaled_height) // 2
+                    output_frame[y_offset:y_offset + scaled_height, :] = scaled_frame
             
-            ffmpeg_process.stdin.write(output_frame.tobytes())
-            frame_number += 1
-            pbar.update(1)
-    
-    ffmpeg_process.stdin.close()
-    stderr_output = ffmpeg_process.stderr.read().decode()
-    ffmpeg_process.wait()
-    cap.release()
+                ffmpeg_process.stdin.write(output_frame.tobytes())
+                frame_number += 1
+                pbar.update(1)
+    except BrokenPipeError:
+        # ffmpeg exited early; its stderr below says why
+        pass
+    finally:
+        cap.release()
+        try:
+            ffmpeg_process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr_output = ffmpeg_process.stderr.read().decode()
+        ffmpeg_process.wait()
 
     if ffmpeg_process.returncode != 0:
-        print("\n❌ FFmpeg frame processing failed.")
-        print("Stderr:", stderr_output)
-        exit()
+        log("\n❌ FFmpeg frame processing failed.")
+        log("Stderr:", stderr_output)
+        raise RuntimeError(f"FFmpeg frame processing failed: {stderr_output}")
     step_end_time = time.time()
-    print(f"✅ Video processing complete in {step_end_time - step_start_time:.2f}s.")
-
-    print("\n🔊 Step 5: Extracting original audio...")
-    step_start_time = time.time()
-    audio_extract_command = [
-        'ffmpeg', '-y', '-i', input_video, '-vn', '-acodec', 'copy', temp_audio_output
-    ]
-    try:
-        subprocess.run(audio_extract_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        step_end_time = time.time()
-        print(f"✅ Audio extracted in {step_end_time - step_start_time:.2f}s.")
-    except subprocess.CalledProcessError as e:
-        print("\n❌ Audio extraction failed.")
-        print("Stderr:", e.stderr.decode())
-        exit()
-
-    print("\n✨ Step 6: Merging video and audio...")
-    step_start_time = time.time()
-    merge_command = [
-        'ffmpeg', '-y', '-i', temp_video_output, '-i', temp_audio_output,
-        '-c:v', 'copy', '-c:a', 'copy', final_output_video
-    ]
-    try:
-        subprocess.run(merge_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        step_end_time = time.time()
-        print(f"✅ Final video merged in {step_end_time - step_start_time:.2f}s.")
-    except subprocess.CalledProcessError as e:
-        print("\n❌ Final merge failed.")
-        print("Stderr:", e.stderr.decode())
-        exit()
-
-    # Clean up temp files
-    os.remove(temp_video_output)
-    os.remove(temp_audio_output)
+    log(f"✅ Video processing complete in {step_end_time - step_start_time:.2f}s.")
 
     script_end_time = time.time()
-    print(f"\n🎉 All done! Final video saved to {final_output_video}")
-    print(f"⏱️  Total execution time: {script_end_time - script_start_time:.2f} seconds.")
\ No newline at end of file
+    log(f"\n🎉 All done! Final video saved to {final_output_video}")
+    log(f"⏱️  Total execution time: {script_end_time - script_start_time:.2f} seconds.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Smartly crops a horizontal video into a vertical one.")
+    parser.add_argument('-i', '--input', type=str, required=True, help="Path to the input video file.")
+    parser.add_argument('-o', '--output', type=str, required=True, help="Path to the output video file.")
+    args = parser.parse_args()
+
+    try:
+        convert(args.input, args.output)
+    except RuntimeError:
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+RQ worker for autocrop conversion jobs.
+Usage: python worker.py
+"""
+
+import logging
+from redis import Redis
+from rq.worker_pool import WorkerPool
+from jobs import REDIS_URL, QUEUE_NAME, USE_SUBPROCESS, NUM_WORKERS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+if __name__ == '__main__':
+    if not USE_SUBPROCESS:
+        # Load the autocrop model once; forked job processes inherit it
+        import main  # noqa: F401
+
+    logger.info(f"Starting {NUM_WORKERS} workers on queue '{QUEUE_NAME}'")
+    pool = WorkerPool([QUEUE_NAME], connection=Redis.from_url(REDIS_URL), num_workers=NUM_WORKERS)
+    pool.start()
\ No newline at end of file
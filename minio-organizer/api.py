@@ -4,16 +4,17 @@ MinIO File Organizer API
 HTTP API wrapper for organizing files in MinIO.
 """
 
-from flask import Flask, request, jsonify
+from quart import Quart, request, jsonify
+import asyncio
 import logging
 from organize import organize_files, MINIO_ENDPOINT
 
-app = Flask(__name__)
+app = Quart(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 @app.route('/health', methods=['GET'])
-def health():
+async def health():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
@@ -22,7 +23,7 @@ def health():
     }), 200
 
 @app.route('/organize', methods=['POST'])
-def organize():
+async def organize():
     """
     Organize files into a folder in MinIO.
     
@@ -47,7 +48,7 @@ def organize():
     }
     """
     try:
-        data = request.get_json()
+        data = await request.get_json()
         
         if not data or 'execution_folder' not in data or 'file_urls' not in data:
             return jsonify({
@@ -66,8 +67,8 @@ def organize():
         
         logger.info(f"Organizing {len(file_urls)} files into folder: {execution_folder}")
         
-        # Organize the files
-        organized_urls = organize_files(execution_folder, file_urls)
+        # Organize the files (blocking S3 calls run off the event loop)
+        organized_urls = await asyncio.to_thread(organize_files, execution_folder, file_urls)
         
         return jsonify({
             "success": True,
@@ -84,4 +85,5 @@ def organize():
         }), 500
 
 if __name__ == '__main__':
+    # Local debugging only; production runs under Hypercorn (see hypercorn_conf.py)
     app.run(host='0.0.0.0', port=8084, debug=False)
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""
+Hypercorn settings for the MinIO organizer API.
+Usage: hypercorn --config file:hypercorn_conf.py api:app
+"""
+
+import os
+
+bind = ['0.0.0.0:8084']
+worker_class = 'asyncio'
+
+# Handlers are pure S3 I/O, so a couple of workers is enough
+workers = int(os.getenv('ORGANIZER_WORKERS', 2))
+
+graceful_timeout = 60
@@ -2,12 +2,38 @@
 """
 MinIO File Organizer
 Moves files into organized folders within MinIO bucket.
+
+Linking large files is opt-in: when LINK_THRESHOLD_MB is set, files larger
+than it are not copied, as long as their filename is unique in the execution
+folder (neither <filename> nor <filename>.ptr exists there yet). Instead, a
+small pointer object named "<execution_folder>/<filename>.ptr" is written
+next to where the file would have gone, and the original stays where it is.
+organize_all_root_files never links, and while linking is enabled it leaves
+root files above the threshold alone, since pointers may reference them. The
+pointer body is JSON:
+
+    {"bucket": "nca-toolkit", "key": "video.mp4", "size": 123456789, "etag": "..."}
+
+Consumers resolve a pointer by reading it and fetching bucket/key.
+
+Copies are written with SSE-S3 server-side encryption when S3_SSE=AES256 is
+set; by default no encryption header is sent.
 """
 
-import boto3
-from botocore.client import Config
+from minio import Minio
+from minio.commonconfig import COPY, CopySource
+from minio.sse import SseS3
+from minio.datatypes import parse_copy_object
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+from concurrent.futures import ThreadPoolExecutor
+import certifi
+import io
+import json
 import os
+import socket
 import sys
+import urllib3
 from urllib.parse import urlparse, unquote
 import logging
 
@@ -20,14 +46,45 @@ MINIO_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'minioadmin')
 MINIO_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'minioadmin')
 MINIO_BUCKET = os.getenv('S3_BUCKET_NAME', 'nca-toolkit')
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    endpoint_url=MINIO_ENDPOINT,
-    aws_access_key_id=MINIO_ACCESS_KEY,
-    aws_secret_access_key=MINIO_SECRET_KEY,
-    config=Config(signature_version='s3v4'),
-    region_name='us-east-1'
+# Server-side encryption for copies, only when configured (S3_SSE=AES256)
+SSE = SseS3() if os.getenv('S3_SSE') == 'AES256' else None
+
+# Number of files copied concurrently
+MAX_WORKERS = 16
+
+# Maximum number of keys per DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+# Files above this size get a pointer object instead of being copied (0 disables)
+LINK_THRESHOLD_MB = int(os.getenv('LINK_THRESHOLD_MB', '0'))
+LINK_THRESHOLD_BYTES = LINK_THRESHOLD_MB * 1024 * 1024
+
+# Per-file outcomes of move_files()
+MOVED = 'moved'
+LINKED = 'linked'
+FAILED = 'failed'
+
+# Initialize MinIO client. The client is thread-safe, so this single client
+# (and its keep-alive urllib3 connection pool) is shared by all worker
+# threads; the pool is sized above MAX_WORKERS so threads don't discard
+# pooled connections. Timeouts and CA certificates match minio's defaults.
+_endpoint = urlparse(MINIO_ENDPOINT)
+s3_client = Minio(
+    _endpoint.netloc,
+    access_key=MINIO_ACCESS_KEY,
+    secret_key=MINIO_SECRET_KEY,
+    secure=_endpoint.scheme == 'https',
+    region='us-east-1',
+    http_client=urllib3.PoolManager(
+        maxsize=64,
+        timeout=urllib3.Timeout(connect=300, read=300),
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+        retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        socket_options=urllib3.connection.HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        ]
+    )
 )
 
 def parse_minio_url(url):
@@ -42,29 +99,187 @@ def parse_minio_url(url):
         return path_parts[0], unquote(path_parts[1])
     return MINIO_BUCKET, unquote(path_parts[0])
 
-def move_file(source_key, dest_key, bucket=MINIO_BUCKET):
+def put_copy(source_key, dest_key, bucket=MINIO_BUCKET):
     """
-    Move a file within MinIO by copying and deleting the original.
+    Send a single PUT-copy request, without the stat_object that
+    Minio.copy_object() runs before every copy. Relies on minio-py
+    internals (Minio._execute, CopySource.gen_copy_headers), checked against
+    minio 7.2.20, which requirements.txt pins.
+    """
+    # Explicit COPY directives keep the source metadata and tags as is,
+    # so MinIO has nothing to rewrite; no Content-MD5 is sent
+    headers = CopySource(bucket_name=bucket, object_name=source_key).gen_copy_headers()
+    headers['x-amz-metadata-directive'] = COPY
+    headers['x-amz-tagging-directive'] = COPY
+    if SSE:
+        headers.update(SSE.headers())
+    response = s3_client._execute('PUT', bucket, object_name=dest_key, headers=headers)
+    # Raises on a 200 response carrying an error body
+    parse_copy_object(response)
+
+def copy_file(source_key, dest_key, bucket=MINIO_BUCKET):
+    """
+    Copy a file within MinIO. The original is left in place.
     """
     try:
-        # Copy the file
-        copy_source = {'Bucket': bucket, 'Key': source_key}
-        s3_client.copy_object(
-            CopySource=copy_source,
-            Bucket=bucket,
-            Key=dest_key
-        )
+        # copy_object is only the fallback for sources the server rejects
+        # as too large for a single PUT-copy
+        try:
+            put_copy(source_key, dest_key, bucket)
+        except S3Error as e:
+            if e.code not in ('InvalidRequest', 'EntityTooLarge'):
+                raise
+            # No directives here: compose_object (used above 5 GiB) rejects
+            # COPY, and S3 copies metadata and tags by default anyway
+            s3_client.copy_object(
+                bucket_name=bucket,
+                object_name=dest_key,
+                source=CopySource(bucket_name=bucket, object_name=source_key),
+                sse=SSE
+            )
         logger.info(f"Copied: {source_key} -> {dest_key}")
-        
-        # Delete the original
-        s3_client.delete_object(Bucket=bucket, Key=source_key)
-        logger.info(f"Deleted original: {source_key}")
-        
         return True
     except Exception as e:
-        logger.error(f"Failed to move {source_key}: {e}")
+        logger.error(f"Failed to copy {source_key}: {e}")
+        return False
+
+def link_file(source_key, dest_key, bucket=MINIO_BUCKET, size=None, etag=None):
+    """
+    Write a pointer object "<dest_key>.ptr" referencing the original file
+    instead of copying its data. The original is left in place.
+    """
+    try:
+        pointer = {'bucket': bucket, 'key': source_key, 'size': size, 'etag': etag}
+        body = json.dumps(pointer).encode('utf-8')
+        s3_client.put_object(
+            bucket_name=bucket,
+            object_name=f"{dest_key}.ptr",
+            data=io.BytesIO(body),
+            length=len(body),
+            content_type='application/json'
+        )
+        logger.info(f"Linked: {dest_key}.ptr -> {source_key}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to link {source_key}: {e}")
         return False
 
+def object_exists(key, bucket=MINIO_BUCKET):
+    """
+    Check whether an object exists in MinIO.
+    """
+    try:
+        s3_client.stat_object(bucket_name=bucket, object_name=key)
+        return True
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+            return False
+        raise
+
+def copy_or_link_file(source_key, dest_key, bucket=MINIO_BUCKET, link=True):
+    """
+    Copy a file, or write a pointer to it if linking is enabled, the file is
+    larger than LINK_THRESHOLD_BYTES and its filename is unique in the
+    destination folder.
+
+    Returns:
+        MOVED if the file was copied, LINKED if a pointer was written,
+        FAILED otherwise
+    """
+    if link and LINK_THRESHOLD_BYTES > 0:
+        try:
+            stat = s3_client.stat_object(bucket_name=bucket, object_name=source_key)
+            if stat.size > LINK_THRESHOLD_BYTES:
+                if object_exists(dest_key, bucket) or object_exists(f"{dest_key}.ptr", bucket):
+                    logger.info(f"{dest_key} already exists, copying instead of linking")
+                elif link_file(source_key, dest_key, bucket, stat.size, stat.etag):
+                    return LINKED
+                else:
+                    return FAILED
+        except Exception as e:
+            logger.error(f"Failed to check {source_key} for linking: {e}")
+            return FAILED
+
+    return MOVED if copy_file(source_key, dest_key, bucket) else FAILED
+
+def delete_files(keys, bucket=MINIO_BUCKET):
+    """
+    Delete files from MinIO using batched DeleteObjects requests.
+
+    Returns:
+        Set of keys that could not be deleted
+    """
+    keys = list(dict.fromkeys(keys))
+    failed = set()
+
+    # DeleteObjects accepts at most 1000 keys per request
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        chunk = keys[i:i + DELETE_BATCH_SIZE]
+        try:
+            # remove_objects is lazy; consuming it sends the request and
+            # yields only the keys that failed
+            errors = list(s3_client.remove_objects(
+                bucket_name=bucket,
+                delete_object_list=[DeleteObject(key) for key in chunk]
+            ))
+        except Exception as e:
+            logger.error(f"Failed to delete {len(chunk)} originals: {e}")
+            failed.update(chunk)
+            continue
+
+        for error in errors:
+            logger.error(f"Failed to delete {error.name}: {error.message}")
+            failed.add(error.name)
+
+        logger.info(f"Deleted {len(chunk) - len(errors)} originals")
+
+    return failed
+
+def move_files(moves, link=True):
+    """
+    Move files within MinIO: copy (or link) every file concurrently, then
+    delete the copied originals in batches per bucket.
+
+    Args:
+        moves: List of (source_key, dest_key, bucket) tuples
+        link: Whether large files may be linked (see LINK_THRESHOLD_MB)
+
+    Returns:
+        List of MOVED/LINKED/FAILED, in the same order as moves. MOVED means
+        the file was copied and its original deleted.
+    """
+    # Pass 1: copy or link (map() keeps results in input order)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(
+            lambda move: copy_or_link_file(*move, link=link),
+            moves
+        ))
+
+    # Pass 2: batched delete of successfully copied originals, per bucket
+    to_delete = {}
+    for (source_key, dest_key, bucket), result in zip(moves, results):
+        if result == MOVED:
+            to_delete.setdefault(bucket, []).append(source_key)
+
+    failed = set()
+    for bucket, keys in to_delete.items():
+        failed.update((bucket, key) for key in delete_files(keys, bucket))
+
+    return [
+        FAILED if result == MOVED and (bucket, source_key) in failed else result
+        for (source_key, dest_key, bucket), result in zip(moves, results)
+    ]
+
+def move_file(source_key, dest_key, bucket=MINIO_BUCKET):
+    """
+    Move a file within MinIO by copying and deleting the original
+    (or linking it, see LINK_THRESHOLD_MB).
+
+    Returns:
+        True if the file was moved or linked
+    """
+    return move_files([(source_key, dest_key, bucket)])[0] != FAILED
+
 def organize_all_root_files(execution_folder, bucket=MINIO_BUCKET):
     """
     Organize ALL files at the root of the bucket into an execution folder.
@@ -80,32 +295,45 @@ def organize_all_root_files(execution_folder, bucket=MINIO_BUCKET):
     new_urls = []
 
     try:
-        # List all objects in the bucket
-        response = s3_client.list_objects_v2(Bucket=bucket)
+        # List the root of the bucket. A non-recursive listing uses
+        # Delimiter='/', so folders come back as is_dir entries, and the
+        # client follows continuation tokens past the 1000-key limit.
+        root_objects = [
+            obj
+            for obj in s3_client.list_objects(bucket_name=bucket, recursive=False)
+            if not obj.is_dir
+        ]
 
-        if 'Contents' not in response:
+        if not root_objects:
             logger.info("No files found in bucket")
             return new_urls
 
-        for obj in response['Contents']:
-            source_key = obj['Key']
-
-            # Skip if it's already in a folder (contains /)
-            if '/' in source_key:
-                continue
+        moves = []
+        for obj in root_objects:
+            source_key = obj.object_name
 
             # Skip if it's the execution folder itself
             if source_key == execution_folder or source_key == execution_folder + '/':
                 continue
 
+            # Large files may be the target of pointers; moving them would
+            # break those pointers
+            if LINK_THRESHOLD_BYTES > 0 and obj.size > LINK_THRESHOLD_BYTES:
+                logger.info(f"Leaving large file at root: {source_key}")
+                continue
+
             # Get filename
             filename = os.path.basename(source_key)
 
             # Create destination key
             dest_key = f"{execution_folder}/{filename}"
 
-            # Move the file
-            if move_file(source_key, dest_key, bucket):
+            moves.append((source_key, dest_key, bucket))
+
+        # Move the files. Root files are never linked: a linked file would
+        # stay at the root and get a new pointer on every later run
+        for (source_key, dest_key, bucket), result in zip(moves, move_files(moves, link=False)):
+            if result == MOVED:
                 new_url = f"{MINIO_ENDPOINT}/{bucket}/{dest_key}"
                 new_urls.append(new_url)
                 logger.info(f"Organized: {source_key} -> {dest_key}")
@@ -126,16 +354,25 @@ def organize_files(execution_folder, file_urls):
     Returns:
         List of new URLs after organization
     """
-    new_urls = []
+    # Keep the original URL unless the file is moved successfully
+    new_urls = list(file_urls)
+    moves = []
+    indexes = []
 
-    for url in file_urls:
+    # URLs for the default bucket are sliced directly; anything else
+    # (other buckets, hosts, query strings) goes through parse_minio_url
+    prefix = f"{MINIO_ENDPOINT}/{MINIO_BUCKET}/"
+
+    for i, url in enumerate(file_urls):
         try:
-            bucket, source_key = parse_minio_url(url)
+            if url.startswith(prefix) and '?' not in url and '#' not in url:
+                bucket, source_key = MINIO_BUCKET, unquote(url[len(prefix):])
+            else:
+                bucket, source_key = parse_minio_url(url)
 
             # Skip if already in a folder
             if source_key.startswith(execution_folder + '/'):
                 logger.info(f"File already in folder: {source_key}")
-                new_urls.append(url)
                 continue
 
             # Get filename from source key
@@ -144,17 +381,21 @@ def organize_files(execution_folder, file_urls):
             # Create destination key
             dest_key = f"{execution_folder}/{filename}"
 
-            # Move the file
-            if move_file(source_key, dest_key, bucket):
-                new_url = f"{MINIO_ENDPOINT}/{bucket}/{dest_key}"
-                new_urls.append(new_url)
-                logger.info(f"Organized: {url} -> {new_url}")
-            else:
-                new_urls.append(url)  # Keep original if move failed
+            moves.append((source_key, dest_key, bucket))
+            indexes.append(i)
 
         except Exception as e:
             logger.error(f"Error processing {url}: {e}")
-            new_urls.append(url)  # Keep original if error
+
+    # Move the files
+    for i, (source_key, dest_key, bucket), result in zip(indexes, moves, move_files(moves)):
+        if result == MOVED:
+            new_url = f"{MINIO_ENDPOINT}/{bucket}/{dest_key}"
+            logger.info(f"Organized: {file_urls[i]} -> {new_url}")
+            new_urls[i] = new_url
+        elif result == LINKED:
+            # Data stays at the original URL
+            logger.info(f"Organized (linked): {file_urls[i]} -> {dest_key}.ptr")
 
     return new_urls
 